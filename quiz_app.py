@@ -7,23 +7,60 @@
 # - Suporte a alternativas dinâmicas A..J (com fallback se 'correta' vier inválida)
 # -------------------------------------------------------------
 
-import os, time, random, hmac, hashlib
+import os, io, csv, time, random, secrets, hmac, hashlib, threading
+from collections import Counter, OrderedDict
+from typing import NamedTuple
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv  # já instalado como dependência do streamlit
 import streamlit as st
-import matplotlib.pyplot as plt
 import requests  # necessário para baixar CSV por URL
 
 # 🔗 URL padrão do CSV no GitHub (RAW) — AJUSTADA!
 DEFAULT_CSV_URL = "https://raw.githubusercontent.com/danbacastro/agoraeusei-app/main/questoes.csv"
 
+# 🎨 CSS montado uma vez por processo. Precisa ir em todo rerun: o Streamlit remove
+# da página os elementos que não forem emitidos de novo, então não dá para "injetar uma vez".
+LOGIN_CSS = (
+    "<style>"
+    ".login-card{max-width:420px;margin:3rem auto;padding:1.25rem 1.5rem;border:1px solid #e5e7eb;border-radius:0.75rem;background:#fff}"
+    "</style>"
+)
+MAIN_CSS = (
+    "<style>"
+    ".badge{display:inline-block;padding:0.25rem 0.5rem;border-radius:999px;font-size:0.75rem;font-weight:600;background:#f1f5f9}"
+    ".badge-blue{background:#e0f2fe}"
+    ".badge-amber{background:#fef3c7}"
+    ".card{padding:1rem 1.25rem;border:1px solid #e5e7eb;border-radius:0.75rem;background:#ffffff}"
+    ".prompt{font-size:1.1rem;line-height:1.6}"
+    ".option{padding:0.5rem 0.75rem;border-radius:0.5rem;background:#f8fafc;margin-bottom:0.25rem}"
+    ".correct{border-left:6px solid #16a34a;background:#ecfdf5}"
+    ".wrong{border-left:6px solid #dc2626;background:#fef2f2}"
+    ".small{font-size:0.875rem;color:#475569}"
+    ".timer{font-weight:600}"
+    "</style>"
+)
+
 # =======================
 # 🔐 Login v2 (per-user / senha global)
 # =======================
 def _sha256(s: str) -> str:
-    import hashlib as _hl
-    return _hl.sha256((s or "").encode("utf-8")).hexdigest().lower()
+    return hashlib.sha256((s or "").encode("utf-8")).hexdigest().lower()
+
+def _sha256_bytes(s: str) -> bytes:
+    # digest bruto (32 bytes) para a comparação em tempo constante; o hex fica só para o diagnóstico
+    return hashlib.sha256((s or "").encode("utf-8")).digest()
 
 def _get_expected_hash(username: str | None) -> tuple[str | None, str]:
+    """Retorna (hash_esperado, modo), memoizado por usuário na sessão (limpo ao sair)."""
+    cache = st.session_state.setdefault("_exp_hash_cache", {})
+    key = username or ""
+    if key not in cache:
+        cache[key] = _lookup_expected_hash(username)
+    return cache[key]
+
+def _lookup_expected_hash(username: str | None) -> tuple[str | None, str]:
     """
     Retorna (hash_esperado, modo).
     Prioridade:
@@ -62,11 +99,7 @@ def check_password() -> bool:
     if st.session_state.get("auth_ok"):
         return True
 
-    st.markdown("""
-    <style>
-    .login-card{max-width:420px;margin:3rem auto;padding:1.25rem 1.5rem;border:1px solid #e5e7eb;border-radius:0.75rem;background:#fff}
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(LOGIN_CSS, unsafe_allow_html=True)
 
     st.markdown('<div class="login-card">', unsafe_allow_html=True)
     st.subheader("🔐 Acesso")
@@ -83,22 +116,28 @@ def check_password() -> bool:
     info = st.empty()
     ok = st.button("Entrar", use_container_width=True)
 
-    with st.expander("Ajuda / Diagnóstico"):
-        exp, mode = _get_expected_hash(username or None)
-        st.caption(f"🔎 Modo detectado: **{mode}**")
-        st.caption(f"Secrets disponíveis: {list(st.secrets.keys())}")
-        if exp:
-            st.caption(f"Hash esperado (prefixo): `{exp[:8]}…`")
-        if password:
-            st.caption(f"Hash digitado (prefixo): `{_sha256(password)[:8]}…`")
+    # diagnóstico só é calculado com o toggle ligado (o expander reconstruía o corpo fechado a cada rerun)
+    if st.toggle("Ajuda / Diagnóstico", value=False, key="_diag_open"):
+        with st.container(border=True):
+            exp, mode = _get_expected_hash(username or None)
+            st.caption(f"🔎 Modo detectado: **{mode}**")
+            st.caption(f"Secrets disponíveis: {list(st.secrets.keys())}")
+            if exp:
+                st.caption(f"Hash esperado (prefixo): `{exp[:8]}…`")
+            if password:
+                st.caption(f"Hash digitado (prefixo): `{_sha256(password)[:8]}…`")
 
     if ok:
-        expected, _ = _get_expected_hash(username or None)
-        if not expected:
+        exp, _ = _get_expected_hash(username or None)
+        if not exp:
             info.error("Senha/usuário não configurados. Defina em Settings → Secrets.")
             return False
 
-        if password and hmac.compare_digest(_sha256(password), expected):
+        try:
+            exp_bytes = bytes.fromhex(exp)
+        except ValueError:  # hash mal formatado nos secrets: nunca confere
+            exp_bytes = b""
+        if password and hmac.compare_digest(_sha256_bytes(password), exp_bytes):
             st.session_state["auth_ok"] = True
             st.session_state["user"] = username or "Usuário"
             try:
@@ -123,7 +162,7 @@ if not check_password():
 
 with st.sidebar:
     if st.button("Sair"):
-        for k in ("auth_ok","user","__usr__","__pwd__"):
+        for k in ("auth_ok","user","__usr__","__pwd__","_exp_hash_cache","_diag_open"):
             st.session_state.pop(k, None)
         try:
             st.experimental_rerun()
@@ -139,21 +178,25 @@ DIFF_LABELS = {1: "Fácil", 2: "Médio", 3: "Difícil", 4: "Muito difícil"}
 def init_state():
     defaults = {
         "df": None,
-        "filtered_df": None,
+        "filtered_records": None,
         "order": [],
+        "round_seed": None,
         "pos": 0,
         "feedback_shown": False,
         "history": [],
+        "hist_tail": None,
+        "last_answer_by_id": {},
+        "err_by_tema": Counter(),
         "stats": {"answered": 0, "correct": 0, "wrong": 0},
         "tema_filtro": [],
         "dificuldade_filtro": [],
         "ready": False,
-        "answered_ids": set(),
-        "shuffle_map": {},
+        "answered_mask": np.zeros(0, dtype=bool),
+        "current_view": None,
         "timer_enabled": False,
         "timer_duration": 60,
-        "question_start_ts": None,
-        "timeout_recorded_ids": set()
+        "deadline_ts": None,
+        "timeout_mask": np.zeros(0, dtype=bool)
     }
     for k, v in defaults.items():
         if k not in st.session_state:
@@ -162,47 +205,110 @@ def init_state():
 # =========================
 # Leitura do CSV (URL / upload / fallback para URL padrão)
 # =========================
-def load_csv(file_or_url) -> pd.DataFrame:
-    import io, csv, unicodedata
-
-    def is_url(x: str) -> bool:
-        return isinstance(x, str) and x.startswith(("http://","https://"))
-
-    # upload
-    if hasattr(file_or_url, "read"):
-        raw = file_or_url.read()
-        text = None
-        for enc in ("utf-8-sig","utf-8","latin-1"):
-            try:
-                text = raw.decode(enc); break
-            except Exception: pass
-        if text is None:
-            st.error("Não foi possível decodificar o arquivo (UTF-8/Latin-1)."); st.stop()
-        df = pd.read_csv(io.StringIO(text), sep=None, engine="python")
-
-    elif is_url(file_or_url):
+# nomes aceitos (já normalizados: minúsculas, sem acento) -> nome canônico.
+# Como todo o script, o dict é refeito a cada rerun (custo desprezível); o ganho está em
+# _decode_and_parse pular o rename quando as colunas já são canônicas.
+COL_ALIASES = {
+    "id":"id","tema":"tema","topico":"tema","enunciado":"enunciado","pergunta":"enunciado",
+    "alternativa_a":"alternativa_a","a":"alternativa_a",
+    "alternativa_b":"alternativa_b","b":"alternativa_b",
+    "alternativa_c":"alternativa_c","c":"alternativa_c",
+    "alternativa_d":"alternativa_d","d":"alternativa_d",
+    "alternativa_e":"alternativa_e","e":"alternativa_e",
+    "alternativa_f":"alternativa_f","f":"alternativa_f",
+    "alternativa_g":"alternativa_g","g":"alternativa_g",
+    "alternativa_h":"alternativa_h","h":"alternativa_h",
+    "alternativa_i":"alternativa_i","i":"alternativa_i",
+    "alternativa_j":"alternativa_j","j":"alternativa_j",
+    "correta":"correta","gabarito":"correta",
+    "explicacao":"explicacao","explicacao/justificativa":"explicacao",
+    "dificuldade":"dificuldade","nivel":"dificuldade",
+    "tags":"tags",
+    # imagens opcionais
+    "imagem1":"imagem1","image1":"imagem1",
+    "imagem2":"imagem2","image2":"imagem2"
+}
+CANONICAL_COLS = frozenset(COL_ALIASES.values())
+
+ETAG_MAX_URLS = 4  # mesmo limite do cache de _decode_and_parse
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    """Sessão HTTP única do processo: o script reexecuta a cada rerun, então ela não pode ser global do módulo."""
+    s = requests.Session()
+    s.headers.update({"Accept-Encoding": "gzip"})
+    return s
+
+@st.cache_resource
+def _etag_store() -> tuple[threading.Lock, OrderedDict]:
+    """(lock, {url: (etag, bytes)}) dos últimos downloads, compartilhado entre sessões; LRU de ETAG_MAX_URLS."""
+    return threading.Lock(), OrderedDict()
+
+def _fetch_bytes(url: str) -> bytes:
+    # GET condicional: CSV inalterado responde 304 sem corpo e reaproveitamos os bytes guardados
+    lock, store = _etag_store()
+    with lock:
+        etag, body = store.get(url, (None, None))
+    headers = {"If-None-Match": etag} if etag else {}
+    r = _http_session().get(url, headers=headers, timeout=20)  # conexão do pool reaproveitada entre downloads
+    if r.status_code == 304 and body is not None:
+        with lock:
+            if url in store:
+                store.move_to_end(url)
+        return body
+    r.raise_for_status()
+    body = r.content  # bytes já descomprimidos; sem passar por r.text
+    etag = r.headers.get("ETag")
+    with lock:
+        if etag:
+            store[url] = (etag, body)
+            store.move_to_end(url)
+            while len(store) > ETAG_MAX_URLS:  # URLs digitadas pelos usuários não acumulam na memória
+                store.popitem(last=False)
+        else:
+            store.pop(url, None)
+    return body
+
+def _read_arrow(raw: bytes, sep: str, names: list[str]) -> pd.DataFrame:
+    """Parser CSV do pyarrow (multithread): todas as colunas como texto, vazios como ""."""
+    # tipos fixados como texto: sem inferência, "001" e "7.40" chegam como estão no arquivo
+    table = pa_csv.read_csv(
+        io.BytesIO(raw),
+        parse_options=pa_csv.ParseOptions(delimiter=sep, newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(column_types={n: pa.string() for n in names},
+                                              null_values=[], strings_can_be_null=False),
+    )
+    return table.to_pandas(types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get)
+
+@st.cache_data(ttl="1h", max_entries=4, show_spinner=False)
+def _decode_and_parse(_raw: bytes, digest: str) -> pd.DataFrame:
+    """Decodifica e normaliza o CSV. Memoizado por `digest` (md5 dos bytes); `_raw` fica fora do hash do cache."""
+    import unicodedata
+
+    # separador: o mais frequente na linha de cabeçalho (nomes de coluna não têm vírgula/;)
+    nl = _raw.find(b"\n")
+    first = _raw[:nl] if nl >= 0 else _raw
+    sep = max((",", ";", "\t", "|"), key=lambda d: first.count(d.encode()))
+
+    # Tudo como texto e sem detecção de NaN: vazios viram "" e são tratados explicitamente abaixo.
+    try:
+        names = next(csv.reader([first.decode("utf-8-sig").rstrip("\r")], delimiter=sep))
+        df = _read_arrow(_raw, sep, names)
+    except (pa.ArrowInvalid, UnicodeDecodeError):
+        # bytes fora do UTF-8 (no cabeçalho o Arrow levanta UnicodeDecodeError, ex.: "Tópico" em latin-1)
+        # ou linhas irregulares: parser do pandas. A codificação sai dos próprios bytes (o Arrow pode ter
+        # parado na forma das linhas antes de validar o UTF-8), então o CSV é parseado uma vez só.
         try:
-            r = requests.get(file_or_url, timeout=20)
-            r.raise_for_status()
-            text = r.text
-            df = pd.read_csv(io.StringIO(text), sep=None, engine="python")
-        except Exception as e:
-            st.error(f"Falha ao baixar CSV da URL: {e}"); st.stop()
+            _raw.decode("utf-8")
+            enc = "utf-8-sig"
+        except UnicodeDecodeError:
+            enc = "latin-1"
 
-    else:  # caminho local
-        with open(file_or_url, "rb") as f:
-            raw = f.read()
-        text = None
-        for enc in ("utf-8-sig","utf-8","latin-1"):
-            try:
-                text = raw.decode(enc); break
-            except Exception: pass
-        if text is None:
-            st.error("Não foi possível decodificar o arquivo (UTF-8/Latin-1)."); st.stop()
-        df = pd.read_csv(io.StringIO(text), sep=None, engine="python")
+        # linhas curtas o parser C já completa com vazios; campos a mais continuam sendo erro (ParserError)
+        df = pd.read_csv(io.BytesIO(_raw), sep=sep, engine="c", encoding=enc, dtype="string", na_filter=False)
 
     # tira Unnamed
-    df = df[[c for c in df.columns if not str(c).lower().startswith("unnamed")]]
+    df = df[[c for c in df.columns if str(c).strip() and not str(c).lower().startswith("unnamed")]]
 
     # normaliza nomes
     def norm_col(c):
@@ -211,28 +317,9 @@ def load_csv(file_or_url) -> pd.DataFrame:
         return c
     df.columns = [norm_col(c) for c in df.columns]
 
-    # renomeia aliases
-    aliases = {
-        "id":"id","tema":"tema","topico":"tema","enunciado":"enunciado","pergunta":"enunciado",
-        "alternativa_a":"alternativa_a","a":"alternativa_a",
-        "alternativa_b":"alternativa_b","b":"alternativa_b",
-        "alternativa_c":"alternativa_c","c":"alternativa_c",
-        "alternativa_d":"alternativa_d","d":"alternativa_d",
-        "alternativa_e":"alternativa_e","e":"alternativa_e",
-        "alternativa_f":"alternativa_f","f":"alternativa_f",
-        "alternativa_g":"alternativa_g","g":"alternativa_g",
-        "alternativa_h":"alternativa_h","h":"alternativa_h",
-        "alternativa_i":"alternativa_i","i":"alternativa_i",
-        "alternativa_j":"alternativa_j","j":"alternativa_j",
-        "correta":"correta","gabarito":"correta",
-        "explicacao":"explicacao","explicacao/justificativa":"explicacao",
-        "dificuldade":"dificuldade","nivel":"dificuldade",
-        "tags":"tags",
-        # imagens opcionais
-        "imagem1":"imagem1","image1":"imagem1",
-        "imagem2":"imagem2","image2":"imagem2"
-    }
-    df = df.rename(columns={c: aliases.get(c, c) for c in df.columns})
+    # renomeia aliases (atalho: CSV já com nomes canônicos dispensa o rename)
+    if not CANONICAL_COLS.issuperset(df.columns):
+        df = df.rename(columns={c: COL_ALIASES.get(c, c) for c in df.columns})
 
     expected_cols_min = [
         "id","tema","enunciado",
@@ -244,46 +331,136 @@ def load_csv(file_or_url) -> pd.DataFrame:
         st.error(f"CSV faltando colunas obrigatórias: {missing}")
         st.stop()
 
-    # normaliza dificuldade 1..4
-    if df["dificuldade"].dtype == object:
+    # normaliza dificuldade 1..4: sem acento -> lookup categórico; texto fora do mapa cai no valor numérico ou em 2
+    if not pd.api.types.is_numeric_dtype(df["dificuldade"]):
         map_txt = {
-            "facil":1,"fácil":1,"easy":1,
-            "medio":2,"médio":2,"medium":2,
-            "dificil":3,"difícil":3,"hard":3,
-            "muito dificil":4,"muito difícil":4,"very hard":4
+            "facil":1,"easy":1,
+            "medio":2,"medium":2,
+            "dificil":3,"hard":3,
+            "muito dificil":4,"very hard":4
         }
-        s = df["dificuldade"].astype(str).str.strip().str.lower()
-        df["dificuldade"] = pd.to_numeric(s.map(map_txt), errors="coerce").fillna(2).astype(int)
+        s = (df["dificuldade"].astype("string").fillna("").str.strip().str.lower()
+             .str.normalize("NFKD").str.encode("ascii", "ignore").str.decode("ascii"))
+        codes = pd.Categorical(s, categories=list(map_txt)).codes
+        vals = np.array(list(map_txt.values()), dtype=np.int8)
+        num = pd.to_numeric(s, errors="coerce").fillna(2).to_numpy()
+        df["dificuldade"] = np.clip(np.where(codes >= 0, vals[codes], num), 1, 4).astype(np.int8)
     else:
-        df["dificuldade"] = pd.to_numeric(df["dificuldade"], errors="coerce").fillna(2).astype(int)
-    df["dificuldade"] = df["dificuldade"].clip(1,4)
+        df["dificuldade"] = np.clip(pd.to_numeric(df["dificuldade"], errors="coerce").fillna(2).to_numpy(), 1, 4).astype(np.int8)
+    # letras com alternativa preenchida por linha (ex.: "ABCDE"), numa passada vetorizada por coluna
+    letters = np.full(len(df), "", dtype="<U10")
+    for L in "ABCDEFGHIJ":
+        col = f"alternativa_{L.lower()}"
+        if col in df.columns:
+            filled = df[col].fillna("").astype(str).str.strip().ne("").to_numpy()
+            letters = np.char.add(letters, np.where(filled, L, ""))
+    df["_letters"] = letters
+    # textos A..J por linha numa tupla fixa (índice = ord(letra) - 65): a exibição indexa em vez de buscar coluna
+    alt_cols = [df[f"alternativa_{L}"].fillna("").astype(str).tolist() if f"alternativa_{L}" in df.columns
+                else [""] * len(df) for L in "abcdefghij"]
+    df["_alts"] = list(zip(*alt_cols)) if len(df) else []
+
+    # normaliza 'correta' uma vez: "a)", " B. " -> "A", "B" (valores inválidos caem no fallback por questão)
+    corr = df["correta"].astype("string").fillna("").str.strip().str.upper()
+    df["_correta"] = corr.where(~corr.str.match(r"^.[).]"), corr.str[0])
+
+    # dtypes compactos: tema/correta com poucos valores distintos viram category; dificuldade já é int8;
+    # textos em buffers Arrow (string[pyarrow]) qualquer que tenha sido o parser usado
+    df["tema"] = df["tema"].mask(df["tema"].str.strip() == "").astype("category")
+    df["correta"] = df["correta"].astype("category")
+    text_cols = ["id","enunciado","explicacao","tags"] + [c for c in df.columns if c.startswith("alternativa_")]
+    df[text_cols] = df[text_cols].astype("string[pyarrow]")
+    # chave estável do conteúdo (cache_data devolve uma cópia nova a cada rerun, então id(df) não serve)
+    df.attrs["digest"] = digest
     return df
 
-def reset_round():
-    df = st.session_state.df.copy()
-    temas = st.session_state.tema_filtro or sorted(df["tema"].dropna().unique().tolist())
-    difs  = st.session_state.dificuldade_filtro or sorted(df["dificuldade"].dropna().unique().tolist())
-    filtered = df[(df["tema"].isin(temas)) & (df["dificuldade"].isin(difs))].reset_index(drop=True)
+@st.cache_data(ttl="10m", show_spinner=False)
+def _load_url(url: str) -> pd.DataFrame:
+    """CSV remoto já parseado, memoizado pela URL: reruns não baixam nem hasheiam o corpo de novo."""
+    try:
+        raw = _fetch_bytes(url)
+    except Exception as e:
+        st.error(f"Falha ao baixar CSV da URL: {e}"); st.stop()
+    return _decode_and_parse(raw, hashlib.md5(raw).hexdigest())
+
+def load_csv(file_or_url) -> pd.DataFrame:
+    def is_url(x: str) -> bool:
+        return isinstance(x, str) and x.startswith(("http://","https://"))
+
+    # upload
+    if hasattr(file_or_url, "read"):
+        raw = file_or_url.getvalue() if hasattr(file_or_url, "getvalue") else file_or_url.read()
+
+    elif is_url(file_or_url):
+        return _load_url(file_or_url)
+
+    else:  # caminho local
+        with open(file_or_url, "rb") as f:
+            raw = f.read()
+
+    return _decode_and_parse(raw, hashlib.md5(raw).hexdigest())
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _df_index(_df: pd.DataFrame, df_key: str) -> tuple[list, list, dict]:
+    """
+    Índices do banco, calculados uma vez por conteúdo e compartilhados entre sessões:
+    temas e níveis distintos (ordenados) e {(tema, dificuldade): posições das linhas}.
+    Filtrar vira concatenar os grupos selecionados, sem máscara booleana sobre o frame.
+    """
+    temas = sorted(_df["tema"].dropna().unique().tolist())
+    nivs = sorted(_df["dificuldade"].dropna().astype(int).unique().tolist())
+    groups = {(t, int(d)): idx.astype(np.int32)
+              for (t, d), idx in _df.groupby(["tema","dificuldade"], observed=True).indices.items()}
+    return temas, nivs, groups
+
+def ensure_df_index():
+    """Recalcula temas/níveis e os grupos (tema, dificuldade) só quando o banco carregado muda."""
+    df = st.session_state.df
+    df_key = df.attrs.get("digest", str(id(df)))
+    if "temas_all" not in st.session_state or st.session_state.get("df_id") != df_key:
+        st.session_state.temas_all, st.session_state.nivs_all, st.session_state.by_tema_dif = _df_index(df, df_key)
+        st.session_state.df_id = df_key
+    return df_key
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _filtered(_df: pd.DataFrame, _groups: dict, df_key: str, temas: tuple, difs: tuple) -> pd.DataFrame:
+    """Subconjunto filtrado por tema/dificuldade. `_df`/`_groups` não entram no hash; a chave é `df_key`."""
+    parts = [_groups[k] for k in ((t, d) for t in temas for d in difs) if k in _groups]
+    idx = np.sort(np.concatenate(parts)) if parts else np.array([], dtype=np.intp)
+    return _df.take(idx).reset_index(drop=True)
+
+def reset_round(seed: int | None = None):
+    df = st.session_state.df  # só leitura: o filtro já devolve um frame novo
+    df_key = ensure_df_index()
+    temas = st.session_state.tema_filtro or st.session_state.temas_all
+    difs  = st.session_state.dificuldade_filtro or st.session_state.nivs_all
+    filtered = _filtered(df, st.session_state.by_tema_dif, df_key, tuple(sorted(temas)), tuple(sorted(difs)))
 
     if filtered.empty:
         st.warning("Nenhuma questão encontrada para os filtros selecionados (tema/dificuldade).")
         st.session_state.ready = False
         return
 
-    order = list(range(len(filtered)))
-    random.shuffle(order)
-
-    st.session_state.filtered_df = filtered
-    st.session_state.order = order
+    # registros simples (dicts): acessar a questão atual não constrói uma Series a cada rerun
+    st.session_state.filtered_records = filtered.to_dict("records")
+    # semente da rodada: ordem das questões e das alternativas passam a ser reprodutíveis
+    if seed is None:
+        seed = secrets.randbits(64)
+    st.session_state.round_seed = seed
+    st.session_state.order = np.random.default_rng(seed).permutation(len(filtered)).astype(np.int32)
     st.session_state.pos = 0
     st.session_state.feedback_shown = False
     st.session_state.history = []
+    st.session_state.hist_tail = None
+    st.session_state.last_answer_by_id = {}
+    st.session_state.err_by_tema = Counter()
     st.session_state.stats = {"answered": 0, "correct": 0, "wrong": 0}
-    st.session_state.answered_ids = set()
-    st.session_state.shuffle_map = {}
-    st.session_state.timeout_recorded_ids = set()
+    # marcas por posição na rodada: tamanho fixo, não crescem com as respostas
+    st.session_state.answered_mask = np.zeros(len(filtered), dtype=bool)
+    st.session_state.current_view = None
+    st.session_state.timeout_mask = np.zeros(len(filtered), dtype=bool)
     st.session_state.ready = True
-    st.session_state.question_start_ts = time.time()
+    st.session_state.deadline_ts = time.monotonic() + st.session_state.timer_duration
 
 def start_new_round_from_theme_change():
     if st.session_state.df is not None:
@@ -294,87 +471,83 @@ def get_current_row():
         return None
     if st.session_state.pos >= len(st.session_state.order):
         return None
-    idx = st.session_state.order[st.session_state.pos]
-    return st.session_state.filtered_df.iloc[idx]
+    idx = int(st.session_state.order[st.session_state.pos])
+    return st.session_state.filtered_records[idx]
 
 # ======= NOVO: suporte a A..J (dinâmico) =======
-def _available_letters_for_row(row: pd.Series) -> list[str]:
-    """Detecta dinamicamente as letras de alternativas disponíveis na linha (A..J)."""
-    letters_all = ["A","B","C","D","E","F","G","H","I","J"]
-    letters = []
-    for L in letters_all:
-        col = f"alternativa_{L.lower()}"
-        if col in row.index and isinstance(row[col], str) and row[col].strip():
-            letters.append(L)
+def _available_letters_for_row(row: dict) -> list[str]:
+    """Letras de alternativas disponíveis na linha (A..J), pré-calculadas em `_letters` no carregamento."""
+    letters = list(row.get("_letters") or "")
     # fallback defensivo: se não achar nada, considera A..E (não quebra)
     if not letters:
         letters = ["A","B","C","D","E"]
     return letters
 
-def ensure_shuffle_for_question(qid: str, letters: list[str]):
-    """Gera e fixa uma ordem de alternativas por questão para estabilidade entre reruns."""
-    if qid not in st.session_state.shuffle_map:
-        ord_ = letters[:]
-        random.shuffle(ord_)
-        st.session_state.shuffle_map[qid] = ord_
-    else:
-        cur = st.session_state.shuffle_map[qid]
-        if set(cur) != set(letters):
-            ord_ = letters[:]
-            random.shuffle(ord_)
-            st.session_state.shuffle_map[qid] = ord_
+class QuestionView(NamedTuple):
+    """Dados de exibição de uma questão, calculados uma vez enquanto ela é a questão atual."""
+    options: tuple         # ((letra_exibida, texto), ...) na ordem embaralhada
+    correct: str           # letra correta NA EXIBIÇÃO
+    original_map: tuple    # ((letra_exibida, letra_original), ...)
+    labels: list           # rótulos do radio ("A) texto"), mesma lista entre reruns
+
+def ensure_shuffle_for_question(qid: str, letters: list[str]) -> list[str]:
+    """
+    Ordem embaralhada das alternativas (letras originais na ordem exibida), derivada de
+    (round_seed, qid): estável entre reruns sem guardar nada por questão no session_state.
+    """
+    order = letters[:]
+    random.Random(f"{st.session_state.round_seed}:{qid}").shuffle(order)
+    return order
 
-def build_display_options(row: pd.Series):
+def build_display_options(row: dict) -> QuestionView:
     """
-    Retorna:
-      - displayed_options: dict {'A': 'texto', ...} com ordem aleatória por questão
-      - displayed_correct_letter: letra correta NA EXIBIÇÃO atual
-      - original_map: dict displayed_letter -> original_letter
-    Aceita A..J. Se 'correta' vier inválida, normaliza; se ainda assim for inválida, usa a 1ª letra como fallback.
+    Retorna o QuestionView (options, correct, original_map, labels) da questão.
+    Só a questão atual fica em cache (current_view, chave (round_seed, pos)); ao trocar de questão ele é recalculado.
+    Aceita A..J. Se 'correta' vier inválida, usa a 1ª letra disponível como fallback.
     NUNCA pula a questão: sempre há um fallback seguro.
     """
     qid = str(row["id"])
-    letters = _available_letters_for_row(row)
-
-    ensure_shuffle_for_question(qid, letters)
-    order = st.session_state.shuffle_map[qid]  # letras originais na ordem exibida
+    # chave pela posição na rodada, não pelo id: ids repetidos em sequência são questões distintas
+    key = (st.session_state.round_seed, st.session_state.pos)
+    cached = st.session_state.current_view
+    if cached is not None and cached[0] == key:
+        return cached[1]
 
-    # textos originais
-    original_texts = {L: row.get(f"alternativa_{L.lower()}", "") for L in letters}
-
-    # monta mapas exibidos
-    displayed_letters = letters[:]  # usamos as mesmas letras
-    displayed_options, original_map = {}, {}
-    for i, disp_letter in enumerate(displayed_letters):
-        orig_letter = order[i]
-        displayed_options[disp_letter] = original_texts[orig_letter]
-        original_map[disp_letter] = orig_letter
+    letters = _available_letters_for_row(row)
+    order = ensure_shuffle_for_question(qid, letters)
 
-    # normaliza 'correta'
-    original_correct = str(row["correta"]).strip().upper()
-    if original_correct and len(original_correct) > 1 and original_correct[1:2] in [")", "."]:
-        original_correct = original_correct[0]
+    # monta mapas exibidos (usamos as mesmas letras)
+    alts = row.get("_alts") or ("",) * 10
+    options = tuple((disp, alts[ord(orig) - 65]) for disp, orig in zip(letters, order))
+    original_map = tuple(zip(letters, order))
 
+    # 'correta' já normalizada no carregamento (coluna _correta)
+    original_correct = row["_correta"]
     if original_correct not in letters:
         # fallback sem pular a questão: usa a primeira letra disponível
         original_correct = letters[0]
 
     # mapeia para a letra exibida correspondente
-    inv_map = {v: k for k, v in original_map.items()}
-    displayed_correct_letter = inv_map.get(original_correct, displayed_letters[0])
+    correct = letters[order.index(original_correct)]
+    labels = [f"{k}) {v}" for k, v in options]
+    view = QuestionView(options, correct, original_map, labels)
+    st.session_state.current_view = (key, view)
+    return view
 
-    return displayed_options, displayed_correct_letter, original_map
-
-def record_answer(row, selected_displayed_letter: str, displayed_correct_letter: str, timeout=False):
+def record_answer(row, selected_displayed_letter: str, displayed_correct_letter: str, timeout=False, pos: int | None = None):
     qid = str(row["id"])
-    if qid in st.session_state.answered_ids:
+    if pos is None:
+        pos = st.session_state.pos
+    if st.session_state.answered_mask[pos]:
         return
     is_correct = (selected_displayed_letter == displayed_correct_letter) and (not timeout)
     st.session_state.stats["answered"] += 1
     if is_correct: st.session_state.stats["correct"] += 1
-    else:         st.session_state.stats["wrong"] += 1
+    else:
+        st.session_state.stats["wrong"] += 1
+        st.session_state.err_by_tema[row["tema"]] += 1
 
-    st.session_state.history.append({
+    entry = {
         "id": qid,
         "tema": row["tema"],
         "dificuldade": int(row["dificuldade"]),
@@ -382,33 +555,40 @@ def record_answer(row, selected_displayed_letter: str, displayed_correct_letter:
         "correct": displayed_correct_letter,
         "acertou": is_correct,
         "timeout": timeout
-    })
-    st.session_state.answered_ids.add(qid)
+    }
+    st.session_state.history.append(entry)
+    st.session_state.last_answer_by_id[qid] = entry
+    st.session_state.answered_mask[pos] = True
 
 def next_question():
     st.session_state.pos += 1
     st.session_state.feedback_shown = False
-    st.session_state.question_start_ts = time.time()
+    st.session_state.deadline_ts = time.monotonic() + st.session_state.timer_duration
+
+def _timer_remaining() -> int:
+    # prazo absoluto em relógio monotônico: imune a ajustes do relógio do sistema
+    if st.session_state.deadline_ts is None:
+        st.session_state.deadline_ts = time.monotonic() + st.session_state.timer_duration
+    return max(0, int(st.session_state.deadline_ts - time.monotonic()))
+
+@st.fragment(run_every=1.0)
+def render_timer(row, displayed_correct_letter: str):
+    """Contagem regressiva em fragmento: só este trecho reroda a cada segundo, não a página inteira."""
+    pos = st.session_state.pos
+    remaining = _timer_remaining()
+    st.markdown(f'⏱️ <span class="timer">Tempo restante:</span> **{remaining}s**', unsafe_allow_html=True)
+    if remaining == 0 and (not st.session_state.feedback_shown) and (not st.session_state.timeout_mask[pos]):
+        record_answer(row, selected_displayed_letter="—", displayed_correct_letter=displayed_correct_letter, timeout=True, pos=pos)
+        st.session_state.feedback_shown = True
+        st.session_state.timeout_mask[pos] = True
+        st.rerun(scope="app")
 
 # =========================
 # UI - Header
 # =========================
 init_state()
 
-st.markdown("""
-<style>
-.badge {display:inline-block; padding:0.25rem 0.5rem; border-radius:999px; font-size:0.75rem; font-weight:600; background:#f1f5f9;}
-.badge-blue {background:#e0f2fe;}
-.badge-amber {background:#fef3c7;}
-.card {padding:1rem 1.25rem; border:1px solid #e5e7eb; border-radius:0.75rem; background:#ffffff;}
-.prompt {font-size:1.1rem; line-height:1.6;}
-.option {padding:0.5rem 0.75rem; border-radius:0.5rem; background:#f8fafc; margin-bottom:0.25rem;}
-.correct {border-left:6px solid #16a34a; background:#ecfdf5;}
-.wrong {border-left:6px solid #dc2626; background:#fef2f2;}
-.small {font-size:0.875rem; color:#475569;}
-.timer {font-weight:600;}
-</style>
-""", unsafe_allow_html=True)
+st.markdown(MAIN_CSS, unsafe_allow_html=True)
 
 left, right = st.columns([0.7, 0.3], gap="large")
 with left:
@@ -457,16 +637,17 @@ with st.sidebar:
 
     if st.session_state.df is not None:
         st.metric("Total de questões", len(st.session_state.df))
+        ensure_df_index()
 
         # Filtro por TEMA
-        temas = sorted(st.session_state.df["tema"].dropna().unique().tolist())
+        temas = st.session_state.temas_all
         st.session_state.tema_filtro = st.multiselect(
             "Filtrar por tema (opcional):", temas, default=temas, on_change=start_new_round_from_theme_change
         )
 
         # Filtro por DIFICULDADE
         DIFF_LABELS = {1: "Fácil", 2: "Médio", 3: "Difícil", 4: "Muito difícil"}
-        nivs = sorted(st.session_state.df["dificuldade"].dropna().astype(int).unique().tolist())
+        nivs = st.session_state.nivs_all
         labels = [DIFF_LABELS.get(int(n), f"Nível {int(n)}") for n in nivs]
         label2num = {v:k for k,v in DIFF_LABELS.items()}
         sel_labels = st.multiselect("Filtrar por dificuldade (opcional):", options=labels, default=labels)
@@ -488,9 +669,12 @@ with st.sidebar:
         with col_sb2:
             if st.button("🧹 Limpar estatísticas", use_container_width=True):
                 st.session_state.history = []
+                st.session_state.hist_tail = None
+                st.session_state.last_answer_by_id = {}
+                st.session_state.err_by_tema = Counter()
                 st.session_state.stats = {"answered": 0, "correct": 0, "wrong": 0}
-                st.session_state.answered_ids = set()
-                st.session_state.timeout_recorded_ids = set()
+                st.session_state.answered_mask[:] = False
+                st.session_state.timeout_mask[:] = False
                 try: st.toast("Estatísticas zeradas.")
                 except Exception: st.success("Estatísticas zeradas.")
 
@@ -501,8 +685,8 @@ if st.session_state.df is None:
     st.stop()
 
 with right:
-    if st.session_state.ready and st.session_state.filtered_df is not None:
-        st.metric("Questões no banco", value=len(st.session_state.filtered_df))
+    if st.session_state.ready and st.session_state.filtered_records is not None:
+        st.metric("Questões no banco", value=len(st.session_state.filtered_records))
     else:
         st.metric("Questões no banco", value=len(st.session_state.df))
 
@@ -536,14 +720,13 @@ if row is None:
 # Cartão da questão
 # ---------------------------
 qid = str(row["id"])
-displayed_options, displayed_correct_letter, original_map = build_display_options(row)
-
-st.markdown('<div class="card">', unsafe_allow_html=True)
+view = build_display_options(row)
+displayed_options, displayed_correct_letter, original_map = view.options, view.correct, view.original_map
 
 # --- Imagens opcionais (imagem1/2 ou image1/2) ---
-img1 = row.get("imagem1", None) if hasattr(row, "get") else None
-img2 = row.get("imagem2", None) if hasattr(row, "get") else None
-if isinstance(row, pd.Series) and (img1 is None):
+img1 = row.get("imagem1", None)
+img2 = row.get("imagem2", None)
+if img1 is None:
     img1 = row.get("image1", None)
     img2 = row.get("image2", None)
 
@@ -563,8 +746,9 @@ if isinstance(img1, str) and img1.strip():
 
 top_cols = st.columns([0.5,0.2,0.3])
 with top_cols[0]:
-    st.markdown(f"**{row['id']}**")
+    # cabeçalho num único bloco HTML: um elemento (e uma mensagem) por rerun em vez de vários
     st.markdown(
+        f'<div><strong>{row["id"]}</strong></div>'
         f'<span class="badge badge-blue">{row["tema"]}</span> &nbsp; '
         f'<span class="badge badge-amber">Dificuldade: {DIFF_LABELS.get(int(row["dificuldade"]), "Médio")}</span>',
         unsafe_allow_html=True
@@ -577,24 +761,19 @@ with top_cols[2]:
 
 # Timer (visual + penalidade)
 if st.session_state.timer_enabled:
-    if st.session_state.question_start_ts is None:
-        st.session_state.question_start_ts = time.time()
-    elapsed = time.time() - st.session_state.question_start_ts
-    remaining = int(st.session_state.timer_duration - elapsed)
-    if remaining < 0: remaining = 0
-    st.markdown(f'⏱️ <span class="timer">Tempo restante:</span> **{remaining}s**', unsafe_allow_html=True)
-    if remaining == 0 and (not st.session_state.feedback_shown) and (qid not in st.session_state.timeout_recorded_ids):
-        record_answer(row, selected_displayed_letter="—", displayed_correct_letter=displayed_correct_letter, timeout=True)
-        st.session_state.feedback_shown = True
-        st.session_state.timeout_recorded_ids.add(qid)
+    if st.session_state.feedback_shown:
+        # já respondida: nada a penalizar, não precisa ficar rerodando
+        st.markdown(f'⏱️ <span class="timer">Tempo restante:</span> **{_timer_remaining()}s**', unsafe_allow_html=True)
+    else:
+        render_timer(row, displayed_correct_letter)
 
-st.markdown(f'<div class="prompt">{row["enunciado"]}</div>', unsafe_allow_html=True)
+st.markdown(f'<div class="card"><div class="prompt">{row["enunciado"]}</div></div>', unsafe_allow_html=True)
 st.divider()
 
 # Alternativas (radio)
 options = displayed_options
 radio_key = f"radio_{qid}"
-labels = [f"{k}) {v}" for k, v in options.items()]
+labels = view.labels
 disabled = st.session_state.feedback_shown
 
 choice_label = st.radio("Escolha uma alternativa:", options=labels, index=None, key=radio_key, disabled=disabled, label_visibility="collapsed")
@@ -615,30 +794,28 @@ if confirm and not st.session_state.feedback_shown:
     else:
         record_answer(row, selected_displayed_letter, displayed_correct_letter, timeout=False)
         st.session_state.feedback_shown = True
+        # o timer (fragmento com run_every) e os botões já foram montados neste rerun com a questão em aberto:
+        # recomeça para desmontá-lo e exibir a questão como respondida
+        st.rerun()
 
 # Feedback
 if st.session_state.feedback_shown:
     with feedback_placeholder:
-        is_correct = False
-        for item in reversed(st.session_state.history):
-            if item["id"] == qid:
-                is_correct = item["acertou"]
-                break
+        last = st.session_state.last_answer_by_id.get(qid)
+        is_correct = bool(last and last["acertou"])
 
         if is_correct:
             st.success("✅ **Correta!**")
         else:
-            last = next((h for h in reversed(st.session_state.history) if h["id"] == qid), None)
             if last and last.get("timeout"):
                 st.error(f"⌛ **Tempo esgotado.** A alternativa correta é **{displayed_correct_letter}**.")
             else:
                 st.error(f"❌ **Errada.** A correta é **{displayed_correct_letter}**.")
 
         st.markdown("**Alternativas:**")
-        for k, v in options.items():
+        marked = last["selected"] if (last and not last.get("timeout")) else None
+        for k, v in options:
             klass = "option"
-            last = next((h for h in reversed(st.session_state.history) if h["id"] == qid), None)
-            marked = last["selected"] if (last and not last.get("timeout")) else None
             if k == displayed_correct_letter:
                 klass += " correct"
             elif marked and k == marked and k != displayed_correct_letter:
@@ -652,8 +829,6 @@ if st.session_state.feedback_shown:
 if prox and st.session_state.feedback_shown:
     next_question()
 
-st.markdown('</div>', unsafe_allow_html=True)
-
 # =========================
 # Estatísticas
 # =========================
@@ -668,30 +843,29 @@ with col_s4:
     acc = (st.session_state.stats["correct"] / st.session_state.stats["answered"] * 100) if st.session_state.stats["answered"] else 0.0
     st.metric("Aproveitamento", f"{acc:.1f}%")
 
-hist_df = pd.DataFrame(st.session_state.history)
-if not hist_df.empty:
-    erros_por_tema = (hist_df.assign(err=lambda d: ~d["acertou"]).groupby("tema")["err"].sum().sort_values(ascending=False))
+if st.session_state.history:
+    # acumulador atualizado em record_answer: O(#temas) por rerun, não O(#respostas)
+    erros_por_tema = pd.Series(st.session_state.err_by_tema, dtype=int).sort_values(ascending=False)
     tema_pior = erros_por_tema.index[0] if not erros_por_tema.empty and erros_por_tema.iloc[0] > 0 else "—"
 
     left_stats, right_stats = st.columns([0.55, 0.45])
     with left_stats:
         st.markdown(f"**Tema com mais erros:** {tema_pior}")
-        st.dataframe(hist_df.tail(10).rename(columns={
-            "id":"ID","tema":"Tema","dificuldade":"Dificuldade",
-            "selected":"Marcada","correct":"Correta","acertou":"Acertou?","timeout":"Timeout?"
-        }), use_container_width=True, height=260)
+        # últimas 10 respostas: só remonta o DataFrame quando o histórico cresce
+        n_hist = len(st.session_state.history)
+        if st.session_state.hist_tail is None or st.session_state.hist_tail[0] != n_hist:
+            tail_df = pd.DataFrame(st.session_state.history[-10:],
+                                   columns=["id","tema","dificuldade","selected","correct","acertou","timeout"])
+            tail_df.columns = ["ID","Tema","Dificuldade","Marcada","Correta","Acertou?","Timeout?"]
+            st.session_state.hist_tail = (n_hist, tail_df)
+        st.dataframe(st.session_state.hist_tail[1], use_container_width=True, height=260)
 
     with right_stats:
-        fig, ax = plt.subplots(figsize=(6,3.2))
+        st.markdown("**Erros por tema**")
+        # gráfico nativo (Vega-Lite no navegador): o servidor só envia as contagens
         if not erros_por_tema.empty:
-            ax.bar(erros_por_tema.index, erros_por_tema.values)
-            ax.set_title("Erros por tema")
-            ax.set_xlabel("Tema")
-            ax.set_ylabel("Erros")
-            ax.tick_params(axis='x', rotation=45, labelsize=8)
+            st.bar_chart(erros_por_tema.rename_axis("Tema").rename("Erros"), height=260)
         else:
-            ax.text(0.5, 0.5, "Sem dados de erro ainda", ha='center', va='center')
-            ax.axis('off')
-        st.pyplot(fig, use_container_width=True)
+            st.caption("Sem dados de erro ainda")
 else:
     st.info("Responda algumas questões para ver estatísticas e gráficos.")